@@ -1,23 +1,148 @@
+import bisect
 import datetime
+import json
 import logging
-import pytz
+import sqlite3
+import threading
+from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_EXECUTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED, \
+    EVENT_JOB_MAX_INSTANCES
+from apscheduler.executors.pool import ThreadPoolExecutor, ProcessPoolExecutor
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.schedulers.blocking import BlockingScheduler
 
-
-class Formatter(logging.Formatter):
-    """override logging.Formatter to use an aware datetime object"""
-
-    def new_converter(self, timestamp):
-        """
-        把vps本地的时间转换为北京时间（不同时区的时间转换）
-        :param self: 本函数赋值给Formatter的成员函数，而成员函数的第一个参数为self，需要为self保留位置；
-        :param timestamp:
-        :return: 返回time.struct_time结构表示的时间；
-        """
-        _ = self  # Just remove the warning
-        return datetime.datetime.fromtimestamp(timestamp).astimezone(pytz.timezone('Asia/Shanghai')).timetuple()
-
-    converter = new_converter
+from utils.log_utils import TZFormatter, AsyncFileHandler
+
+JOBS_DB = 'apscheduler_jobs.sqlite'
+# job持久化到sqlite，重启后不丢失（pip install sqlalchemy）
+JOBSTORES = {'default': SQLAlchemyJobStore(url=f'sqlite:///{JOBS_DB}')}
+# I/O类job走线程池，CPU类job走进程池（add_job时指定executor='processpool'）
+EXECUTORS = {'default': ThreadPoolExecutor(10), 'processpool': ProcessPoolExecutor(2)}
+JOB_DEFAULTS = {
+    'coalesce': True,  # 错过的多次执行合并成一次
+    'max_instances': 1,  # 上一次还没跑完时跳过本次，而不是叠加运行
+    'misfire_grace_time': 30 * 60,  # 错过执行时间30分钟以内仍然补跑
+}
+# 运行时长直方图的桶上限（秒），最后一档是超过1天，即每日cron job自己和自己重叠
+DURATION_BUCKETS = (1, 10, 60, 300, 900, 3600, 4 * 3600, 24 * 3600)
+# 提交后超过这么久还没收到执行结束事件（比如进程池worker挂了），就当作丢失，不再等它
+STALE_SUBMISSION = datetime.timedelta(days=2)
+# True: 日志由后台线程批量写文件，记录日志的线程不等磁盘I/O
+ASYNC_LOG = True
+
+
+class JobDurationStats(object):
+    """
+    监听scheduler事件，按job统计运行时长直方图。
+    时长 = 提交给executor到执行结束的时间，线程池和进程池的job都适用；
+    被max_instances挡掉的次数记在overlaps里，说明上一次执行还没结束。
+    统计结果存在db_file的job_duration_stats表里（和job store同一个sqlite文件），重启后接着累计。
+    """
+
+    def __init__(self, logger, db_file=JOBS_DB, buckets=DURATION_BUCKETS, stale_after=STALE_SUBMISSION):
+        self.logger = logger
+        self.db_file = db_file
+        self.buckets = buckets
+        self.stale_after = stale_after
+        self.lock = threading.Lock()
+        self.submitted = {}  # (job_id, scheduled_run_time) -> 提交时间
+        self.histograms = {}  # job_id -> 每个桶的计数，最后一个是溢出桶
+        self.overlaps = {}
+        self.missed = {}
+        self.lost = {}  # 提交后一直没有结束事件的次数
+        self.load()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file)
+        conn.execute('CREATE TABLE IF NOT EXISTS job_duration_stats ('
+                     'job_id TEXT PRIMARY KEY, buckets TEXT, histogram TEXT, overlaps INTEGER, missed INTEGER, '
+                     'lost INTEGER)')
+        return conn
+
+    def load(self):
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT job_id, buckets, histogram, overlaps, missed, lost '
+                                'FROM job_duration_stats').fetchall()
+        finally:
+            conn.close()
+        for job_id, buckets, histogram, overlaps, missed, lost in rows:
+            if json.loads(buckets) == list(self.buckets):  # 桶的划分改了就丢弃旧的直方图
+                self.histograms[job_id] = json.loads(histogram)
+            self.overlaps[job_id] = overlaps
+            self.missed[job_id] = missed
+            self.lost[job_id] = lost
+
+    def save(self, job_id):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO job_duration_stats VALUES (?, ?, ?, ?, ?, ?)',
+                             (job_id, json.dumps(list(self.buckets)),
+                              json.dumps(self.histograms.get(job_id, [0] * (len(self.buckets) + 1))),
+                              self.overlaps.get(job_id, 0), self.missed.get(job_id, 0), self.lost.get(job_id, 0)))
+        finally:
+            conn.close()
+
+    def listener(self, event):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        with self.lock:
+            self.prune(now)
+            if event.code == EVENT_JOB_SUBMITTED:
+                for run_time in event.scheduled_run_times:
+                    self.submitted[(event.job_id, run_time)] = now
+                return
+            if event.code in (EVENT_JOB_EXECUTED, EVENT_JOB_ERROR):
+                start = self.submitted.pop((event.job_id, event.scheduled_run_time), None)
+                if start is None:
+                    return
+                self.record(event.job_id, (now - start).total_seconds())
+            elif event.code == EVENT_JOB_MAX_INSTANCES:
+                self.overlaps[event.job_id] = self.overlaps.get(event.job_id, 0) + 1
+                self.logger.warning(f'Job {event.job_id} skipped: previous run is still running.')
+            elif event.code == EVENT_JOB_MISSED:
+                # 错过执行的检查在executor的run_job里，这时SUBMITTED已经发过，不清掉会被prune()再算成lost
+                self.submitted.pop((event.job_id, event.scheduled_run_time), None)
+                self.missed[event.job_id] = self.missed.get(event.job_id, 0) + 1
+                self.logger.warning(f'Job {event.job_id} missed run at {event.scheduled_run_time}.')
+            else:
+                return
+            self.save(event.job_id)
+
+    def prune(self, now):
+        """清理一直没等到结束事件的提交记录，避免submitted无限增长"""
+        for key, submitted_at in list(self.submitted.items()):
+            if now - submitted_at > self.stale_after:
+                del self.submitted[key]
+                job_id, run_time = key
+                self.lost[job_id] = self.lost.get(job_id, 0) + 1
+                self.logger.warning(f'Job {job_id} submitted at {submitted_at} for {run_time} never finished.')
+                self.save(job_id)
+
+    def record(self, job_id, seconds):
+        histogram = self.histograms.setdefault(job_id, [0] * (len(self.buckets) + 1))
+        histogram[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.logger.info(f'Job {job_id} finished in {seconds:.3f}s, duration histogram: {self.format(job_id)}')
+
+    def snapshot(self):
+        """当前所有job的统计，{job_id: {'histogram': {...}, 'overlaps': n, 'missed': n, 'lost': n}}"""
+        labels = self.labels()
+        with self.lock:
+            job_ids = set(self.histograms) | set(self.overlaps) | set(self.missed) | set(self.lost)
+            return {job_id: {'histogram': dict(zip(labels, self.histograms.get(job_id, []))),
+                             'overlaps': self.overlaps.get(job_id, 0),
+                             'missed': self.missed.get(job_id, 0),
+                             'lost': self.lost.get(job_id, 0)} for job_id in job_ids}
+
+    def labels(self):
+        return [f'<={b}s' for b in self.buckets] + [f'>{self.buckets[-1]}s']
+
+    def format(self, job_id):
+        histogram = self.histograms.get(job_id, [])
+        parts = [f'{label}:{count}' for label, count in zip(self.labels(), histogram) if count]
+        parts.append(f'overlaps:{self.overlaps.get(job_id, 0)}')
+        parts.append(f'missed:{self.missed.get(job_id, 0)}')
+        parts.append(f'lost:{self.lost.get(job_id, 0)}')
+        return ' '.join(parts)
 
 
 def ashares_main():
@@ -28,9 +153,11 @@ def task2():
     pass
 
 
-def ashares_main_wrapper(logger):
+def ashares_main_wrapper():
+    # job会被序列化进sqlite，所以不通过args传logger，在这里按名字取
+    logger = logging.getLogger('ashares')
     try:
-        ashares_main(logger)
+        ashares_main()
     except:
         logger.exception('Exception Logged')
 
@@ -38,17 +165,25 @@ def ashares_main_wrapper(logger):
 if __name__ == '__main__':
     logger = logging.getLogger('ashares')  # 父logger
     logger.setLevel(logging.DEBUG)
-    fh = logging.FileHandler('my.log', encoding='utf-8')
+    fh = AsyncFileHandler('my.log', encoding='utf-8') if ASYNC_LOG else logging.FileHandler('my.log', encoding='utf-8')
     fh.setLevel(logging.DEBUG)
-    fh.setFormatter(Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    # 日志时间用北京时间，与vps本地时区无关
+    fh.setFormatter(TZFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s', tz='Asia/Shanghai'))
     logger.addHandler(fh)
 
-    scheduler = BlockingScheduler()
+    scheduler = BlockingScheduler(jobstores=JOBSTORES, executors=EXECUTORS, job_defaults=JOB_DEFAULTS,
+                                  timezone='Asia/Shanghai')
+    stats = JobDurationStats(logger)
+    for job_id, job_stats in stats.snapshot().items():
+        logger.info(f'Job {job_id} history: {job_stats}')
+    scheduler.add_listener(stats.listener, EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR |
+                           EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES)
 
-    # 定时任务
-    scheduler.add_job(ashares_main_wrapper, 'cron', args=(logger,), hour=4, minute=11, timezone='Asia/Shanghai')
+    # 定时任务；固定id + replace_existing，重启时更新sqlite里的job而不是重复添加
+    scheduler.add_job(ashares_main_wrapper, 'cron', id='ashares_main', replace_existing=True,
+                      hour=4, minute=11, timezone='Asia/Shanghai')
 
-    # 立即启动
-    scheduler.add_job(task2)
+    # 立即启动（CPU类任务，放到进程池）
+    scheduler.add_job(task2, id='task2', replace_existing=True, executor='processpool')
 
     scheduler.start()
@@ -1,18 +1,197 @@
 #!/usr/local/python3/bin/python3
+"""
+    ** 异步回调接收端 **
+    pip install quart
+    Quart是Flask API兼容的ASGI框架，可以直接 python callback.py 运行，也可以用 hypercorn/uvicorn 启动：
+        hypercorn callback:app --bind 127.0.0.1:5002
 
-from flask import Flask, request
-import json
+    - /callback 同时接受单条 {"taskID": ..., "sum": ...} 和批量 [{...}, {...}] 两种payload；
+    - 请求处理只负责入队，后台writer按批次追加写入JSONL文件，不阻塞请求；
+    - 按taskID去重（启动时从已有的JSONL文件恢复已见过的taskID）；只有落盘成功的taskID才算见过，
+      写文件失败时会重试，重试仍失败则放弃这一批并允许调用方重发；
+    - /metrics 输出最近RATE_WINDOW秒内的接收速率和队列深度。
+"""
+
+import asyncio
+import collections
 import datetime
+import json
+import os
+import time
+
+from quart import Quart, request
+
+SINK_FILE = 'callback_results.jsonl'
+QUEUE_MAXSIZE = 100000
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 1.0  # 秒，队列不满一批时最多等待这么久就落盘
+WRITE_RETRIES = 3
+RATE_WINDOW = 10  # 秒，/metrics里ingest_rate的统计窗口
+
+app = Quart(__name__)
+
+queue = None
+writer_task = None
+seen_task_ids = set()  # 已落盘的taskID
+pending_task_ids = set()  # 已入队、还没落盘的taskID
+stats = {
+    'started': None,    # startup()里设置
+    'received': 0,      # 收到的记录数（含重复）
+    'accepted': 0,      # 去重后入队的记录数
+    'duplicates': 0,
+    'written': 0,       # 已落盘的记录数
+    'flushes': 0,
+    'write_errors': 0,  # 写文件失败的次数（含重试）
+    'lost': 0,          # 重试后仍写失败、被放弃的记录数
+}
+ingest_buckets = collections.deque()  # [整数秒, 该秒收到的记录数]，只保留最近RATE_WINDOW秒
+
+
+def count_ingest(n):
+    now = int(time.monotonic())
+    if ingest_buckets and ingest_buckets[-1][0] == now:
+        ingest_buckets[-1][1] += n
+    else:
+        ingest_buckets.append([now, n])
+    while ingest_buckets[0][0] <= now - RATE_WINDOW:
+        ingest_buckets.popleft()
+
+
+def ingest_rate(uptime):
+    """最近RATE_WINDOW秒（刚启动时为已运行的时间）内平均每秒收到的记录数"""
+    now = int(time.monotonic())
+    received = sum(n for second, n in ingest_buckets if second > now - RATE_WINDOW)
+    window = min(RATE_WINDOW, uptime)
+    return received / window if window > 0 else 0.0
+
+
+def load_seen_task_ids(filename):
+    """
+    从已有的JSONL文件中恢复taskID，保证重启之后依然能去重。
+    :param filename:
+    :return: set of taskID
+    """
+    ids = set()
+    if not os.path.exists(filename):
+        return ids
+    with open(filename, 'r', encoding='utf-8') as fr:
+        for line in fr:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                ids.add(json.loads(line)['taskID'])
+            except (ValueError, KeyError):
+                continue  # 最后一行可能因进程被杀而写了一半
+    return ids
 
-app = Flask(__name__)
+
+def write_batch(filename, batch):
+    """同步写一批记录，由writer通过线程池调用，不占用事件循环"""
+    with open(filename, 'a', encoding='utf-8') as fw:
+        fw.write(''.join(json.dumps(d, ensure_ascii=False) + '\n' for d in batch))
+        fw.flush()
+        os.fsync(fw.fileno())
+
+
+async def batch_writer():
+    """后台协程：从队列里攒一批记录，再一次性追加写入文件"""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await queue.get()]
+        deadline = loop.time() + FLUSH_INTERVAL
+        while len(batch) < BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        task_ids = [d['taskID'] for d in batch]
+        try:
+            for attempt in range(WRITE_RETRIES):
+                try:
+                    await loop.run_in_executor(None, write_batch, SINK_FILE, batch)
+                except Exception:
+                    stats['write_errors'] += 1
+                    app.logger.exception(f'Failed to write {len(batch)} callbacks (attempt {attempt + 1}).')
+                    if attempt + 1 < WRITE_RETRIES:
+                        await asyncio.sleep(2 ** attempt)
+                else:
+                    seen_task_ids.update(task_ids)
+                    stats['written'] += len(batch)
+                    stats['flushes'] += 1
+                    break
+            else:
+                stats['lost'] += len(batch)
+                app.logger.error(f'Dropped {len(batch)} callbacks after {WRITE_RETRIES} attempts, '
+                                 f'senders may retry them.')
+        finally:
+            # 不管成功与否都要出队，否则shutdown()里的queue.join()会一直等下去
+            pending_task_ids.difference_update(task_ids)
+            for _ in batch:
+                queue.task_done()
+
+
+@app.before_serving
+async def startup():
+    global queue, writer_task
+    seen_task_ids.update(load_seen_task_ids(SINK_FILE))
+    stats['started'] = time.monotonic()
+    queue = asyncio.Queue(maxsize=QUEUE_MAXSIZE)
+    writer_task = asyncio.create_task(batch_writer())
+
+
+@app.after_serving
+async def shutdown():
+    await queue.join()  # 把队列里剩余的记录落盘后再退出
+    writer_task.cancel()
 
 
 @app.route('/callback', methods=['POST'])
-def callback():
-    d = json.loads(request.get_data())
+async def callback():
+    try:
+        payload = json.loads(await request.get_data())
+    except ValueError:
+        return json.dumps({"msg": 'invalid json', "code": '1'}), 400
+    items = payload if isinstance(payload, list) else [payload]
+
+    for d in items:
+        # taskID要能放进set，也要能原样写进JSON
+        if not isinstance(d, dict) or not isinstance(d.get('taskID'), (str, int)):
+            return json.dumps({"msg": 'invalid taskID', "code": '1'}), 400
+
     timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    print(f"'{timestamp}' taskID = {d['taskID']}, {d['sum']}")
-    return json.dumps({"msg": 'ok', "code": '0'})
+    accepted = 0
+    stats['received'] += len(items)
+    count_ingest(len(items))
+    for d in items:
+        task_id = d['taskID']
+        if task_id in seen_task_ids or task_id in pending_task_ids:
+            stats['duplicates'] += 1
+            continue
+        if queue.full():
+            # 队列满时宁可让调用方重试，也不要把请求一直挂着
+            stats['accepted'] += accepted
+            return json.dumps({"msg": 'busy', "code": '2', "accepted": accepted}), 503
+        pending_task_ids.add(task_id)
+        queue.put_nowait(dict(d, received=timestamp))
+        accepted += 1
+    stats['accepted'] += accepted
+    return json.dumps({"msg": 'ok', "code": '0', "accepted": accepted})
+
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    uptime = time.monotonic() - stats['started']
+    d = dict(stats)
+    d.pop('started')
+    d['uptime'] = round(uptime, 3)
+    d['ingest_rate'] = round(ingest_rate(uptime), 3)  # 条/秒
+    d['queue_depth'] = queue.qsize()
+    return json.dumps(d)
+
 
 if __name__ == '__main__':
-    app.run(port='5002', debug=True)
+    app.run(port=5002, debug=True)
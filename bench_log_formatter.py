@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+    ** logging时区Formatter性能对比 **
+    legacy:       原apscheduler_demo.py的Formatter，每条记录都做一次datetime + pytz时区转换 + FileHandler
+    tz_formatter: utils/log_utils.py 的 TZFormatter（zoneinfo，按秒缓存时间前缀）+ FileHandler
+    tz_async:     TZFormatter + AsyncFileHandler（后台线程批量写文件）
+
+    统计records/sec（包括handler关闭时把缓冲写完的时间），以及调用方每条记录的平均耗时。
+    python bench_log_formatter.py -n 200000
+"""
+import argparse
+import datetime
+import logging
+import os
+import time
+
+from utils.log_utils import TZFormatter, AsyncFileHandler, DEFAULT_FORMAT
+
+try:
+    import pytz
+
+    def _timezone(name):
+        return pytz.timezone(name)
+except ImportError:
+    from zoneinfo import ZoneInfo as _timezone  # 没装pytz时用zoneinfo做同样的逐条转换
+
+
+class LegacyFormatter(logging.Formatter):
+    """原apscheduler_demo.py里的实现"""
+
+    def new_converter(self, timestamp):
+        _ = self
+        return datetime.datetime.fromtimestamp(timestamp).astimezone(_timezone('Asia/Shanghai')).timetuple()
+
+    converter = new_converter
+
+
+def run(mode, filename, count):
+    if os.path.exists(filename):
+        os.remove(filename)
+    logger = logging.getLogger(f'bench_log_formatter.{mode}')
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    if mode == 'legacy':
+        handler = logging.FileHandler(filename, encoding='utf-8')
+        handler.setFormatter(LegacyFormatter(DEFAULT_FORMAT))
+    elif mode == 'tz_formatter':
+        handler = logging.FileHandler(filename, encoding='utf-8')
+        handler.setFormatter(TZFormatter(DEFAULT_FORMAT))
+    else:
+        handler = AsyncFileHandler(filename, encoding='utf-8')
+        handler.setFormatter(TZFormatter(DEFAULT_FORMAT))
+    logger.addHandler(handler)
+
+    start = time.perf_counter()
+    for i in range(count):
+        logger.info('record %d', i)
+    caller = time.perf_counter() - start
+    logger.removeHandler(handler)
+    handler.close()
+    elapsed = time.perf_counter() - start
+    print(f'{mode:<13} records/sec={count / elapsed:>10.0f}  caller={caller / count * 1e6:.2f}us/record')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='logging时区Formatter性能对比')
+    parser.add_argument('-n', '--records', type=int, default=200000, help='日志条数')
+    args = parser.parse_args()
+
+    for m in ('legacy', 'tz_formatter', 'tz_async'):
+        run(m, f'bench_{m}.log', args.records)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+    ** 跨进程logging性能对比 **
+    queue:      utils/log_utils.py 的 QueueHandler + listener进程
+    mp_handler: multiprocessing_logging.install_mp_handler（pip install multiprocessing-logging，仅Linux）
+
+    统计：发出/写入/丢弃的条数，records/sec（按实际写入的条数，从开始发日志到全部写入文件）、
+    worker在logger调用里累计阻塞的时间。
+    mp_handler不会丢日志，所以queue模式的队列默认能装下全部记录，两边做的是同样多的工作；
+    用 -q 指定较小的队列可以观察背压下的丢弃情况。
+    python bench_mp_logging.py -n 20000 -w 8
+"""
+import argparse
+import logging
+import os
+import time
+from multiprocessing import Pool
+
+from utils.log_utils import QueueLogging, init_worker_logging, DEFAULT_FORMAT
+
+LOGGER_NAME = 'bench_mp_logging'
+
+
+def emit_records(count):
+    """worker：连续打count条日志，返回花在logger.info里的总时间"""
+    logger = logging.getLogger(LOGGER_NAME)
+    stall = 0.0
+    for i in range(count):
+        t0 = time.perf_counter()
+        logger.info(f'[PID: {os.getpid()}] record {i}')
+        stall += time.perf_counter() - t0
+    return stall
+
+
+def run(mode, filename, total, workers, queue_size=None):
+    if os.path.exists(filename):
+        os.remove(filename)
+    logger = logging.getLogger(LOGGER_NAME)
+    for h in list(logger.handlers):
+        logger.removeHandler(h)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+
+    initializer, initargs, qlog = None, (), None
+    if mode == 'queue':
+        qlog = QueueLogging(filename, queue_size=queue_size or total + 1)
+        qlog.start()
+        qlog.install(logger)
+        initializer, initargs = init_worker_logging, qlog.worker_initargs(LOGGER_NAME)
+    else:
+        from multiprocessing_logging import install_mp_handler
+        fh = logging.FileHandler(filename, encoding='utf-8')
+        fh.setFormatter(logging.Formatter(DEFAULT_FORMAT))
+        logger.addHandler(fh)
+        install_mp_handler(logger)
+
+    per_task = 1000
+    counts = [per_task] * (total // per_task) + ([total % per_task] if total % per_task else [])
+    start = time.perf_counter()
+    dropped = 0
+    try:
+        p = Pool(workers, initializer=initializer, initargs=initargs)
+        stalls = p.map(emit_records, counts, chunksize=1)
+        # 不能用with语句：Pool.__exit__会terminate worker，队列feeder线程里没发出去的记录就丢了
+        p.close()
+        p.join()
+    finally:
+        if qlog is not None:
+            dropped = qlog.stop()
+        else:
+            for h in list(logger.handlers):
+                h.close()  # 等待接收线程把管道里的记录写完
+                logger.removeHandler(h)
+    elapsed = time.perf_counter() - start
+
+    with open(filename, 'r', encoding='utf-8') as fr:
+        written = sum(1 for _ in fr)
+    print(f'{mode:<10} offered={total:<8} written={written:<8} dropped={dropped:<6} '
+          f'records/sec={written / elapsed:>10.0f}  '
+          f'worker stall total={sum(stalls):.3f}s max/task={max(stalls):.3f}s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='跨进程logging性能对比')
+    parser.add_argument('-n', '--records', type=int, default=20000, help='日志总条数')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help='worker进程数')
+    parser.add_argument('-q', '--queue-size', type=int, help='queue模式的队列长度，缺省为能装下全部记录')
+    args = parser.parse_args()
+
+    run('queue', 'bench_queue.log', args.records, args.workers, args.queue_size)
+    try:
+        run('mp_handler', 'bench_mp_handler.log', args.records, args.workers)
+    except ImportError:
+        print('mp_handler skipped: pip install multiprocessing-logging')
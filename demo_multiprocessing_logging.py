@@ -1,46 +1,60 @@
 #!/usr/bin/env python
 """
     ** python跨进程logger demo **
-    pip install multiprocessing-logging
-    https://pypi.org/project/multiprocessing-logging/
-    Only works on POSIX systems and only Linux is supported. It does not work on Windows.
+    worker进程通过QueueHandler把日志放进队列，由单独的listener进程批量写文件，见 utils/log_utils.py。
+    只依赖标准库，不再需要 multiprocessing-logging（它只支持Linux，且worker会阻塞在管道写日志上）。
+    和原方案的性能对比见 bench_mp_logging.py。
+    任务分发用 utils/parallel_utils.py 的 parallel_map（自适应chunksize、收集结果、统计worker利用率），
+    纯数值的部分还可以走 vector_map + NumPy kernel。
 """
 import os
 import time
 import random
 import logging
-from multiprocessing import Pool
-from multiprocessing_logging import install_mp_handler
+
+from utils.log_utils import QueueLogging, init_worker_logging
+from utils.parallel_utils import parallel_map, vector_map, format_stats
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # 没有numpy时跳过向量化kernel的对比
+
+logger = logging.getLogger('demo_mp_logging')  # 父logger
 
 
 def test_process(n):
-    my_sum = 0
-    for x in range(n):
-        my_sum += x
+    my_sum = sum(range(n))  # 内置sum在C里循环，比逐个累加快得多
 
     time.sleep(random.randint(0, 4))
     logger.info(f'[PID: {os.getpid()}] sum is {my_sum}.')
+    return my_sum
+
+
+def sum_range_kernel(ns):
+    """test_process计算部分的向量化版本：对数组里每个n求sum(range(n))"""
+    ns = ns.astype(np.int64)
+    return ns * (ns - 1) // 2
 
 
 if __name__ == '__main__':
     # log utility
-    global logger
-    logger = logging.getLogger('demo_mp_logging')  # 父logger
-    install_mp_handler(logger)
-    logger.setLevel(logging.DEBUG)
-    fh = logging.FileHandler('multiprocessing_logging.log', encoding='utf-8')
-    fh.setLevel(logging.DEBUG)
-    # Using the customized Formatter due to timezone issue.
-    fh.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-    logger.addHandler(fh)
-
-    logger.info('Initialized multiprocessing logger.')
-
-    p = Pool(os.cpu_count())
-
-    for i in range(100, 400):
-        p.apply_async(test_process, args=(i,))
-
-    p.close()
-    p.join()
-    logger.info('End multi process.')
+    qlog = QueueLogging('multiprocessing_logging.log', max_bytes=10 * 1024 * 1024, backup_count=5)
+    qlog.start()
+    qlog.install(logger)
+
+    try:
+        logger.info('Initialized multiprocessing logger.')
+
+        results, stats = parallel_map(test_process, range(100, 400), processes=os.cpu_count(),
+                                      initializer=init_worker_logging, initargs=qlog.worker_initargs(logger.name))
+        logger.info(f'End multi process, total sum is {sum(results)}.')
+        print(format_stats(stats))
+
+        if np is not None:
+            vector_results = vector_map(sum_range_kernel, np.arange(100, 400))
+            logger.info(f'Vectorized kernel matches: {vector_results.tolist() == results}.')
+    finally:
+        dropped = qlog.stop()
+    if dropped:
+        print(f'{dropped} log records dropped due to full queue.')
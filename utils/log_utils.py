@@ -0,0 +1,316 @@
+"""
+    ** 基于队列的跨进程logging **
+    worker进程里用QueueHandler把LogRecord放进multiprocessing.Queue（非阻塞），
+    单独的listener进程负责从队列里批量取出记录，通过带缓冲的BatchedRotatingFileHandler写文件。
+
+    - 队列满时不阻塞worker，直接丢弃这条记录并计数（QueueLogging.dropped）；
+    - 文件按大小（max_bytes）和/或时间（interval秒）滚动；
+    - 只依赖标准库，Linux/Windows都可以用（spawn方式下通过Pool的initializer安装handler）。
+
+    单进程场景下：
+    - TZFormatter: 用zoneinfo把时间转成指定时区，时区只解析一次，并按秒缓存格式化好的时间前缀；
+    - AsyncFileHandler: 调用方只把记录放进队列，由后台线程格式化并批量写文件。
+
+    用法：
+        qlog = QueueLogging('app.log')
+        qlog.start()
+        qlog.install(logger)
+        p = Pool(os.cpu_count(), initializer=init_worker_logging, initargs=qlog.worker_initargs(logger.name))
+        ...
+        qlog.stop()
+"""
+import atexit
+import copy
+import datetime
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+import traceback
+import weakref
+from zoneinfo import ZoneInfo  # Windows上需要 pip install tzdata
+
+DEFAULT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class TZFormatter(logging.Formatter):
+    """
+    按指定时区输出asctime。同一秒内的记录复用上一次格式化好的时间字符串，
+    避免每条记录都做一次时区转换和strftime。
+    """
+
+    def __init__(self, fmt=None, datefmt=None, tz='Asia/Shanghai'):
+        super().__init__(fmt, datefmt)
+        self.tz = ZoneInfo(tz)
+        self._cache = (None, None)  # (整数秒, 格式化好的时间)，整体替换，多线程下也不会读到一半
+
+    def formatTime(self, record, datefmt=None):
+        second = int(record.created)
+        cached_second, prefix = self._cache
+        if second != cached_second:
+            dt = datetime.datetime.fromtimestamp(second, self.tz)
+            prefix = dt.strftime(datefmt or self.default_time_format)
+            self._cache = (second, prefix)
+        if datefmt or not self.default_msec_format:
+            return prefix
+        return self.default_msec_format % (prefix, record.msecs)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时不阻塞，丢弃记录并累加共享计数器"""
+
+    def __init__(self, q, dropped=None):
+        super().__init__(q)
+        self.dropped = dropped  # multiprocessing.Value('L')，可以为None
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if self.dropped is not None:
+                with self.dropped.get_lock():
+                    self.dropped.value += 1
+
+
+class BatchedRotatingFileHandler(logging.Handler):
+    """
+    带缓冲的文件handler：格式化后的记录先攒在内存里，满capacity条或调用flush()时一次性写入。
+    max_bytes > 0 时按大小滚动，interval > 0 时按时间（秒）滚动，备份文件为 filename.1 ~ filename.N。
+    和标准库RotatingFileHandler一样，backup_count为0时不滚动，文件一直追加。
+    """
+
+    def __init__(self, filename, max_bytes=0, interval=0, backup_count=5, capacity=1000, encoding='utf-8'):
+        super().__init__()
+        self.baseFilename = os.path.abspath(filename)
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.backup_count = backup_count
+        self.capacity = capacity
+        self.encoding = encoding
+        self.buffer = []
+        self.stream = self._open()
+        self.rollover_at = time.time() + interval if interval > 0 else None
+
+    def _open(self):
+        return open(self.baseFilename, 'a', encoding=self.encoding, buffering=1 << 20)
+
+    def emit(self, record):
+        try:
+            self.buffer.append(self.format(record) + '\n')
+            if len(self.buffer) >= self.capacity:
+                self._write_buffer()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        self.acquire()
+        try:
+            self._write_buffer()
+        finally:
+            self.release()
+
+    def _write_buffer(self):
+        if not self.buffer:
+            return
+        data = ''.join(self.buffer)
+        self.buffer.clear()
+        if self._should_rollover(len(data)):
+            self.do_rollover()
+        self.stream.write(data)
+        self.stream.flush()
+
+    def _should_rollover(self, size):
+        if self.backup_count <= 0:
+            return False
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return True
+        # 按字符数估算字节数，对滚动阈值来说足够了
+        return self.max_bytes > 0 and self.stream.tell() > 0 and self.stream.tell() + size > self.max_bytes
+
+    def do_rollover(self):
+        self.stream.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f'{self.baseFilename}.{i}'
+            if os.path.exists(src):
+                os.replace(src, f'{self.baseFilename}.{i + 1}')
+        os.replace(self.baseFilename, f'{self.baseFilename}.1')
+        self.stream = self._open()
+        if self.interval > 0:
+            self.rollover_at = time.time() + self.interval
+
+    def close(self):
+        self.acquire()
+        try:
+            if not self.stream.closed:  # 可能被调用两次（AsyncFileHandler和logging.shutdown）
+                self._write_buffer()
+                self.stream.close()
+        finally:
+            self.release()
+        super().close()
+
+
+class AsyncFileHandler(logging.handlers.QueueHandler):
+    """
+    异步文件handler：emit只把记录放进内存队列，后台线程格式化后通过BatchedRotatingFileHandler批量写文件。
+    setFormatter设置的是后台线程用的formatter；其余参数同BatchedRotatingFileHandler。
+    fork出来的子进程（如ProcessPoolExecutor的worker）没有后台线程，子进程里的记录改为同步写入文件。
+    """
+
+    def __init__(self, filename, flush_interval=1.0, **handler_kwargs):
+        # target必须先于本handler创建：logging.shutdown按创建的逆序关闭handler，
+        # 这样退出时先由本handler的close()把队列写完再关闭target，之后shutdown再关target是空操作
+        self.target = BatchedRotatingFileHandler(filename, **handler_kwargs)
+        super().__init__(queue.Queue())  # 不限长度：同一进程内，宁可占内存也不丢日志
+        self._thread = threading.Thread(target=_drain, name='async-file-handler',
+                                        args=(self.queue, self.target, flush_interval), daemon=True)
+        self._thread.start()
+        self._pid = os.getpid()
+        _async_handlers.add(self)
+
+    def _after_fork_in_child(self):
+        # 继承来的队列可能处于加锁状态，且没有线程在读；父进程缓冲里的记录由父进程负责写
+        self.queue = queue.Queue()
+        self.target.buffer.clear()
+
+    def emit(self, record):
+        if os.getpid() != self._pid:
+            try:
+                self.target.handle(self.prepare(record))
+                self.target.flush()
+            except Exception:
+                self.handleError(record)
+            return
+        super().emit(record)
+
+    def prepare(self, record):
+        # 同一进程内不需要pickle，但%参数要在调用方线程里先合成消息，
+        # 否则后台线程格式化时看到的是可变参数之后的状态；其余格式化（时间、exc_info等）留给后台线程
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def setFormatter(self, fmt):
+        self.target.setFormatter(fmt)
+
+    def close(self):
+        if self._thread.is_alive():
+            self.queue.put(None)
+            self._thread.join()
+        super().close()
+
+
+_async_handlers = weakref.WeakSet()
+
+
+def _reset_async_handlers_in_child():
+    for handler in list(_async_handlers):
+        handler._after_fork_in_child()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_async_handlers_in_child)
+
+
+def _drain(q, handler, flush_interval):
+    """
+    从队列里批量取记录交给handler，收到None(sentinel)后关闭handler返回。
+    距上次flush超过flush_interval秒就flush一次，不管队列是否空闲，避免记录一直攒在内存里。
+    """
+    last_flush = time.monotonic()
+    while True:
+        timeout = max(0.0, last_flush + flush_interval - time.monotonic())
+        try:
+            batch = [q.get(timeout=timeout)]
+        except queue.Empty:
+            batch = []
+        # 一次尽量多取，减少每条记录的唤醒开销
+        while batch and batch[-1] is not None and len(batch) < handler.capacity:
+            try:
+                batch.append(q.get_nowait())
+            except queue.Empty:
+                break
+        for record in batch:
+            if record is None:
+                _call_guarded(handler.close)
+                return
+            handler.handle(record)
+        if time.monotonic() - last_flush >= flush_interval:
+            _call_guarded(handler.flush)
+            last_flush = time.monotonic()
+
+
+def _call_guarded(func):
+    """flush/close出错（如磁盘满）只打印异常，不让drain循环退出，否则队列会被写满"""
+    try:
+        func()
+    except Exception:
+        traceback.print_exc()
+
+
+def _listener_main(q, filename, fmt, datefmt, handler_kwargs, flush_interval):
+    """listener进程入口"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C由父进程处理，这里要把队列写完
+    handler = BatchedRotatingFileHandler(filename, **handler_kwargs)
+    handler.setFormatter(logging.Formatter(fmt, datefmt))
+    _drain(q, handler, flush_interval)
+
+
+class QueueLogging(object):
+    """管理日志队列、丢弃计数和listener进程"""
+
+    def __init__(self, filename, fmt=DEFAULT_FORMAT, datefmt=None, queue_size=10000, flush_interval=1.0,
+                 max_bytes=0, interval=0, backup_count=5, capacity=1000):
+        self.queue = multiprocessing.Queue(queue_size)
+        self.dropped = multiprocessing.Value('L', 0)
+        handler_kwargs = dict(max_bytes=max_bytes, interval=interval, backup_count=backup_count, capacity=capacity)
+        self._process = multiprocessing.Process(
+            target=_listener_main, name='log-listener',
+            args=(self.queue, filename, fmt, datefmt, handler_kwargs, flush_interval))
+
+    def start(self):
+        self._process.start()
+        # listener是非daemon进程且忽略SIGINT，没调用stop()就退出（异常、Ctrl+C）时，
+        # multiprocessing会在退出时一直等它。atexit后注册先执行，排在multiprocessing的退出处理之前
+        atexit.register(self.stop)
+
+    def install(self, logger, level=logging.DEBUG):
+        """当前进程的logger改为只往队列里放记录"""
+        install_queue_handler(logger, self.queue, self.dropped, level)
+
+    def worker_initargs(self, logger_name, level=logging.DEBUG):
+        return logger_name, self.queue, self.dropped, level
+
+    def stop(self, timeout=10):
+        atexit.unregister(self.stop)
+        if self._process.is_alive():
+            # 用put放sentinel：和本进程之前的记录走同一个feeder线程，保证排在它们后面
+            try:
+                self.queue.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+            self._process.join(timeout)
+            if self._process.is_alive():
+                self._process.terminate()
+                self._process.join()
+        if self._process.exitcode != 0:
+            # listener已经不在了，管道里剩下的数据没人读，不要让本进程退出时等feeder线程
+            self.queue.cancel_join_thread()
+        return self.dropped.value
+
+
+def install_queue_handler(logger, q, dropped=None, level=logging.DEBUG):
+    for h in list(logger.handlers):  # fork出来的子进程会继承父进程的handler
+        logger.removeHandler(h)
+    logger.addHandler(DroppingQueueHandler(q, dropped))
+    logger.setLevel(level)
+    logger.propagate = False
+
+
+def init_worker_logging(logger_name, q, dropped, level=logging.DEBUG):
+    """Pool的initializer，在每个worker进程里安装QueueHandler"""
+    install_queue_handler(logging.getLogger(logger_name), q, dropped, level)
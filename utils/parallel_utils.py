@@ -0,0 +1,162 @@
+"""
+    ** 进程池批量分发工具 **
+    parallel_map: 基于Pool.imap_unordered，边收结果边按实测的单任务耗时调整后续chunk的大小，按输入顺序返回结果，
+                  同时统计每个worker的利用率和每个任务摊到的非计算时间。
+    vector_map:   数值计算的向量化路径，把输入切成大块交给NumPy kernel一次算完，数据量小时直接在本进程计算。
+"""
+import functools
+import math
+import os
+import threading
+import time
+from multiprocessing import Pool
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # vector_map 需要 numpy：pip install numpy
+
+
+def _timed_chunk(func, chunk):
+    start = time.perf_counter()
+    results = [(index, func(arg)) for index, arg in chunk]
+    return results, os.getpid(), time.perf_counter() - start
+
+
+class _ChunkFeeder(object):
+    """
+    给imap_unordered的任务序列。Pool的任务线程会一口气把序列读完，所以这里用信号量限制在途的chunk数，
+    每收回一个chunk才放出下一个，下一个chunk的大小按当时已完成任务的平均耗时决定。
+    还没有耗时数据时chunk大小为1；chunksize不为None时固定用它。
+    """
+
+    def __init__(self, items, processes, chunksize, target_chunk_time):
+        self.items = items
+        self.processes = processes
+        self.chunksize = chunksize
+        self.target_chunk_time = target_chunk_time
+        self.slots = threading.Semaphore(processes * 2)
+        self.lock = threading.Lock()
+        self.closed = False
+        self.done_tasks = 0
+        self.done_time = 0.0
+        self.chunks = 0
+        self.last_chunksize = chunksize
+
+    def __iter__(self):
+        pos = 0
+        while pos < len(self.items):
+            self.slots.acquire()
+            if self.closed:
+                return
+            size = self.chunksize or self.next_chunksize(len(self.items) - pos)
+            self.chunks += 1
+            self.last_chunksize = size
+            yield self.items[pos:pos + size]
+            pos += size
+
+    def next_chunksize(self, remaining):
+        with self.lock:
+            if not self.done_tasks:
+                return 1
+            avg = self.done_time / self.done_tasks
+        return adaptive_chunksize(remaining, self.processes, avg, self.target_chunk_time)
+
+    def done(self, n_tasks, elapsed):
+        with self.lock:
+            self.done_tasks += n_tasks
+            self.done_time += elapsed
+        self.slots.release()
+
+    def close(self):
+        """出错时让任务线程从acquire里出来，否则Pool.terminate()会一直等它"""
+        self.closed = True
+        self.slots.release()
+
+
+def adaptive_chunksize(n_items, processes, avg_task_time, target_chunk_time=0.05):
+    """
+    每个chunk大约跑target_chunk_time秒，这样IPC开销被摊薄；同时每个worker至少分到4个chunk，保证负载均衡。
+    :param n_items: 待分发的任务数
+    :param processes: worker数
+    :param avg_task_time: 实测的单任务平均耗时（秒）
+    :param target_chunk_time:
+    :return: chunksize
+    """
+    by_time = target_chunk_time / avg_task_time if avg_task_time > 0 else n_items
+    by_balance = math.ceil(n_items / (processes * 4))
+    return max(1, min(int(by_time), by_balance))
+
+
+def parallel_map(func, iterable, processes=None, chunksize=None, initializer=None, initargs=(),
+                 target_chunk_time=0.05):
+    """
+    并行执行func(item)，返回 (results, stats)，results和输入顺序一致。
+    chunksize为None时，前几个chunk只放1个任务，之后每个chunk的大小按已完成任务的平均耗时由adaptive_chunksize决定；
+    探测和正式分发是同一条流水线，慢任务不会让其他worker空等。
+    func必须是模块级函数（能被pickle）。
+    """
+    items = list(enumerate(iterable))
+    processes = processes or os.cpu_count()
+    call = functools.partial(_timed_chunk, func)
+    feeder = _ChunkFeeder(items, processes, chunksize, target_chunk_time)
+    results = [None] * len(items)
+    busy = {}
+
+    start = time.perf_counter()
+    p = Pool(processes, initializer=initializer, initargs=initargs)
+    try:
+        for chunk_results, pid, elapsed in p.imap_unordered(call, feeder, chunksize=1):
+            feeder.done(len(chunk_results), elapsed)
+            for index, result in chunk_results:
+                results[index] = result
+            busy[pid] = busy.get(pid, 0.0) + elapsed
+        p.close()
+    except BaseException:
+        feeder.close()
+        p.terminate()
+        raise
+    finally:
+        p.join()
+    wall = time.perf_counter() - start
+
+    total_busy = sum(busy.values())
+    stats = {
+        'tasks': len(items),
+        'processes': processes,
+        'chunks': feeder.chunks,
+        'chunksize': feeder.last_chunksize,  # 最后一个chunk用的大小
+        'wall': wall,
+        'busy': total_busy,
+        # 每个worker花在func上的时间占总耗时的比例
+        'utilization': {pid: t / wall for pid, t in busy.items()} if wall > 0 else {},
+        # 平均每个任务摊到的非计算时间：进程启动、序列化、IPC，以及负载不均/收尾阶段worker空等的时间，
+        # 后者在任务耗时差异大时占大头，不全是调度开销
+        'idle_per_task': (wall * processes - total_busy) / len(items) if items else 0.0,
+    }
+    return results, stats
+
+
+def format_stats(stats):
+    lines = [f"tasks={stats['tasks']} processes={stats['processes']} chunks={stats['chunks']} "
+             f"last chunksize={stats['chunksize']} wall={stats['wall']:.3f}s busy={stats['busy']:.3f}s "
+             f"idle+overhead/task={stats['idle_per_task'] * 1000:.3f}ms"]
+    for pid, u in sorted(stats['utilization'].items()):
+        lines.append(f'  [PID: {pid}] utilization {u:.1%}')
+    return '\n'.join(lines)
+
+
+def vector_map(kernel, values, processes=None, min_items_per_process=100000):
+    """
+    向量化路径：kernel接收一个numpy数组，返回同样长度的数组。
+    数据量不足以抵消进程开销时直接在本进程调用kernel，否则切成processes块并行计算再拼接。
+    """
+    if np is None:
+        raise ImportError("vector_map requires 'numpy', e.g. pip install numpy")
+    values = np.asarray(values)
+    processes = processes or os.cpu_count()
+    n_chunks = min(processes, len(values) // min_items_per_process)
+    if n_chunks <= 1:
+        return kernel(values)
+    with Pool(n_chunks) as p:
+        return np.concatenate(p.map(kernel, np.array_split(values, n_chunks)))